@@ -1,11 +1,26 @@
 import asyncio
-import json
+import atexit
 import logging
 import os
+import queue
+import random
 import re
 import threading
+import time
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
+from html import escape
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener
+from string import Template
+from urllib.parse import urlsplit
+import aiohttp
+import httpx
+import orjson
 from dotenv import load_dotenv
 
 from livekit import agents, rtc, api
@@ -21,37 +36,88 @@ from livekit.plugins import sarvam
 # Tavily for real-time web search
 from tavily import AsyncTavilyClient
 
-# Notion for conversation logging
-from notion_client import Client as NotionClient
-
 # Load environment variables
 load_dotenv()
 
+# libuv-backed event loop for the worker and, since job processes import this
+# module too, for every call's audio I/O. Not available on Windows.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
+
 # Initialize Tavily client (will be None if API key not set)
 TAVILY_API_KEY = os.environ.get("TAVILY_API_KEY")
 tavily_client = AsyncTavilyClient(api_key=TAVILY_API_KEY) if TAVILY_API_KEY else None
 
-# Initialize Notion client (will be None if credentials not set)
+# Tavily responses are reused for repeat queries/URLs. TTLs are in seconds;
+# extracted pages change far less often than search results
+TAVILY_SEARCH_TTL = 30 * 60
+TAVILY_EXTRACT_TTL = 6 * 60 * 60
+TAVILY_CACHE_SIZE = 256
+_tavily_cache: dict[str, tuple[float, dict]] = {}
+# Requests in flight, by cache key; entries live only until the fetch finishes
+_tavily_inflight: dict[str, asyncio.Task] = {}
+
+
+async def _fetch_tavily(key: str, ttl: float, fetch) -> dict:
+    """Await `fetch()` and cache its response under `key`."""
+    response = await fetch()
+    if len(_tavily_cache) >= TAVILY_CACHE_SIZE:
+        del _tavily_cache[next(iter(_tavily_cache))]
+    _tavily_cache[key] = (time.monotonic() + ttl, response)
+    return response
+
+
+async def _cached_tavily(key: str, ttl: float, fetch) -> dict:
+    """Return the cached Tavily response for `key`, or await `fetch()` and cache it.
+    
+    Concurrent misses on the same key share one request instead of each
+    calling Tavily.
+    """
+    entry = _tavily_cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    
+    task = _tavily_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_tavily(key, ttl, fetch))
+        _tavily_inflight[key] = task
+        # Dropped whether the fetch succeeds or raises, so failed keys leave nothing behind
+        task.add_done_callback(lambda _: _tavily_inflight.pop(key, None))
+    # Shielded so one caller being cancelled doesn't cancel the others' request
+    return await asyncio.shield(task)
+
+
+# Notion for conversation logging. It's only used after hangup, so the SDK is
+# imported and the client created on the first save (see get_notion_client)
 NOTION_TOKEN = os.environ.get("NOTION_TOKEN")
 NOTION_DATABASE_ID = os.environ.get("NOTION_DATABASE_ID")
-notion_client = NotionClient(auth=NOTION_TOKEN) if NOTION_TOKEN else None
+notion_client = None
+# Sessions with fewer messages (dropped calls, test probes) aren't saved
+NOTION_MIN_MESSAGES = int(os.environ.get("NOTION_MIN_MESSAGES", 2))
+# ...and so are misdials/abandoned calls shorter than this many seconds
+NOTION_MIN_DURATION = float(os.environ.get("NOTION_MIN_DURATION", 5))
 
-# Initialize Resend for cloud-compatible email (SMTP is blocked on Railway)
-import resend
+# Resend for cloud-compatible email (SMTP is blocked on Railway), called over
+# its REST API from the event loop
 RESEND_API_KEY = os.environ.get("RESEND_API_KEY")
 RESEND_FROM_EMAIL = os.environ.get("RESEND_FROM_EMAIL", "onboarding@resend.dev")  # Use verified domain in production
-if RESEND_API_KEY:
-    resend.api_key = RESEND_API_KEY
+RESEND_EMAILS_URL = "https://api.resend.com/emails"
+
+
+# Prebaked health check reply - the response never changes, so skip
+# send_response/send_header formatting on every probe
+_HEALTH_OK = b"HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n\r\nOK"
 
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
     """Simple HTTP handler for Railway health checks."""
     
     def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        self.wfile.write(b'OK')
+        self.wfile.write(_HEALTH_OK)
     
     def log_message(self, format, *args):
         # Suppress health check logs to reduce noise
@@ -59,15 +125,29 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
 
 
 def start_health_server():
-    """Start a simple HTTP server for health checks in a background thread."""
+    """Start a simple HTTP server for health checks in a background thread.
+    
+    Railway's public $PORT gets only this handler; the LiveKit worker's own
+    HTTP server (/worker, /debug with per-job chat history) stays on its
+    internal default port.
+    """
     port = int(os.environ.get('PORT', 8080))
     server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
     thread = threading.Thread(target=server.serve_forever, daemon=True)
     thread.start()
-    logging.getLogger("vocalize-agent").info(f"Health check server running on port {port}")
+    logging.getLogger("vocalize-agent").info("Health check server running on port %d", port)
+
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: the event loop only enqueues records, a listener thread
+# formats and writes them to stderr so logging never blocks on I/O
+_log_queue: queue.Queue = queue.Queue(-1)
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_log_listener = QueueListener(_log_queue, _log_handler)
+logging.getLogger().addHandler(QueueHandler(_log_queue))
+logging.getLogger().setLevel(logging.INFO)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger("vocalize-agent")
 
 
@@ -79,20 +159,28 @@ logger = logging.getLogger("vocalize-agent")
 # ============================================================
 # 📊 SESSION LOGGING - Easy to spot in Railway logs
 # ============================================================
+_BAR = "=" * 60
+_DASH = "-" * 60
+
+
 def log_session_start(room_name: str, user_name: str, participant_id: str, is_phone: bool = False):
     """Log a visually distinct session start banner."""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     session_type = "PHONE CALL" if is_phone else "WEBRTC"
     
-    logger.info("")
-    logger.info("=" * 60)
-    logger.info(f"  NEW {session_type} SESSION")
-    logger.info(f"  Time: {timestamp}")
-    logger.info(f"  User: {user_name or 'Unknown'}")
-    logger.info(f"  Room: {room_name}")
-    logger.info(f"  ID:   {participant_id}")
-    logger.info("=" * 60)
-    logger.info("")
+    # Emit the whole banner as one record (one lock + one write instead of nine)
+    lines = [
+        "",
+        _BAR,
+        f"  NEW {session_type} SESSION",
+        f"  Time: {timestamp}",
+        f"  User: {user_name or 'Unknown'}",
+        f"  Room: {room_name}",
+        f"  ID:   {participant_id}",
+        _BAR,
+        "",
+    ]
+    logger.info("\n".join(lines))
 
 
 def log_session_end(room_name: str, user_name: str, duration_seconds: float):
@@ -100,150 +188,320 @@ def log_session_end(room_name: str, user_name: str, duration_seconds: float):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     # Format duration
-    minutes = int(duration_seconds // 60)
-    seconds = int(duration_seconds % 60)
+    minutes, seconds = divmod(int(duration_seconds), 60)
     duration_str = f"{minutes}m {seconds}s" if minutes > 0 else f"{seconds}s"
     
-    logger.info("")
-    logger.info("-" * 60)
-    logger.info(f"  SESSION ENDED")
-    logger.info(f"  Time: {timestamp}")
-    logger.info(f"  User: {user_name or 'Unknown'}")
-    logger.info(f"  Room: {room_name}")
-    logger.info(f"  Duration: {duration_str}")
-    logger.info("-" * 60)
-    logger.info("")
+    lines = [
+        "",
+        _DASH,
+        "  SESSION ENDED",
+        f"  Time: {timestamp}",
+        f"  User: {user_name or 'Unknown'}",
+        f"  Room: {room_name}",
+        f"  Duration: {duration_str}",
+        _DASH,
+        "",
+    ]
+    logger.info("\n".join(lines))
 
 
 # ============================================================
 # 📝 NOTION CONVERSATION LOGGER
 # ============================================================
+# Speaker tags stored on each message; the prefix strings are built only once
+_USER, _AGENT = 0, 1
+_SPEAKER_PREFIX = ("[User] ", "[Agent] ")
+
+
+@dataclass(slots=True)
+class TranscriptMessage:
+    """A single transcript line: speaker tag and text."""
+    speaker: int
+    text: str
+
+
+# Most messages kept per conversation (oldest are dropped beyond this)
+TRACKER_MAX_MESSAGES = int(os.environ.get("TRACKER_MAX_MESSAGES", 2000))
+
+
 class ConversationTracker:
     """Tracks conversation messages for later saving to Notion."""
     
     def __init__(self, user_name: str, is_phone_call: bool = False):
         self.user_name = user_name
         self.is_phone_call = is_phone_call
-        self.messages: list[dict] = []
+        # Bounded so a stuck or marathon session can't grow without limit;
+        # once full, the oldest messages give way and are counted in `dropped`
+        self.messages: deque[TranscriptMessage] = deque(maxlen=TRACKER_MAX_MESSAGES)
+        self.dropped = 0
         self.start_time = datetime.now()
+        self._t0 = time.monotonic()
+        self._final_duration: str | None = None
+    
+    def _add(self, speaker: int, text: str):
+        if len(self.messages) == self.messages.maxlen:
+            self.dropped += 1
+        self.messages.append(TranscriptMessage(speaker, text))
     
     def add_user_message(self, text: str):
         """Add a user message to the transcript."""
-        self.messages.append({
-            "speaker": "User",
-            "text": text,
-            "timestamp": datetime.now().strftime("%H:%M:%S")
-        })
+        self._add(_USER, text)
     
     def add_agent_message(self, text: str):
         """Add an agent message to the transcript."""
-        self.messages.append({
-            "speaker": "Agent",
-            "text": text,
-            "timestamp": datetime.now().strftime("%H:%M:%S")
-        })
+        self._add(_AGENT, text)
+    
+    def elapsed_seconds(self) -> float:
+        """Seconds since the tracker was created."""
+        return time.monotonic() - self._t0
     
     def get_duration_str(self) -> str:
-        """Get formatted duration string."""
-        duration = (datetime.now() - self.start_time).total_seconds()
-        minutes = int(duration // 60)
-        seconds = int(duration % 60)
-        return f"{minutes}m {seconds}s" if minutes > 0 else f"{seconds}s"
+        """Get formatted duration string (fixed after the first call)."""
+        if self._final_duration is None:
+            minutes, seconds = divmod(int(self.elapsed_seconds()), 60)
+            self._final_duration = f"{minutes}m {seconds}s" if minutes > 0 else f"{seconds}s"
+        return self._final_duration
     
     def format_transcript(self) -> str:
         """Format the conversation as a readable transcript."""
-        lines = []
-        for msg in self.messages:
-            lines.append(f"[{msg['speaker']}] {msg['text']}")
-        return "\n\n".join(lines)
+        return "\n\n".join(_SPEAKER_PREFIX[msg.speaker] + msg.text for msg in self.messages)
+
+
+# Notion API limits: children blocks per create/append request, and
+# characters per rich_text content
+NOTION_MAX_CHILDREN = 100
+NOTION_MAX_TEXT = 2000
+
+_PARA_TEMPLATE = {"object": "block", "type": "paragraph"}
+
+
+def _paragraph_block(content: str) -> dict:
+    """Build a Notion paragraph block holding a single text run."""
+    return {**_PARA_TEMPLATE, "paragraph": {"rich_text": [{"type": "text", "text": {"content": content}}]}}
+
+
+# Background Notion writer: session teardown only enqueues the tracker and a
+# worker task writes it with the async SDK, so hangup never waits on the Notion API.
+notion_queue: asyncio.Queue = asyncio.Queue()
+_notion_worker_task: asyncio.Task | None = None
+
+
+def get_notion_client():
+    """Import the Notion SDK and create the async client on first use."""
+    global notion_client
+    if notion_client is None:
+        from notion_client import AsyncClient as NotionClient
+        
+        class OrjsonNotionClient(NotionClient):
+            """Notion client that encodes request bodies with orjson.
+            
+            The SDK hands bodies to httpx's `json=`, which uses the stdlib
+            encoder; transcript appends are large nested block lists.
+            """
+            
+            def _build_request(self, method, path, query=None, body=None, *args, **kwargs):
+                request = super()._build_request(method, path, query, None, *args, **kwargs)
+                if body is None:
+                    return request
+                headers = httpx.Headers(request.headers)
+                headers.pop("Content-Length", None)
+                headers["Content-Type"] = "application/json"
+                # Carry extensions over: they hold the SDK's per-request timeout
+                return httpx.Request(
+                    method,
+                    request.url,
+                    headers=headers,
+                    content=orjson.dumps(body),
+                    extensions=request.extensions,
+                )
+        
+        notion_client = OrjsonNotionClient(auth=NOTION_TOKEN)
+    return notion_client
+
+
+# Notion allows ~3 requests/second per integration token. All calls share one
+# schedule, and 429s are retried after Retry-After.
+NOTION_REQUESTS_PER_SECOND = 3
+NOTION_MAX_RETRIES = 4
+_notion_next_slot = 0.0
+
+
+async def _notion_throttle():
+    """Wait for the next request slot under the Notion rate limit."""
+    global _notion_next_slot
+    now = time.monotonic()
+    wait = _notion_next_slot - now
+    _notion_next_slot = max(now, _notion_next_slot) + 1 / NOTION_REQUESTS_PER_SECOND
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def _notion_call(fn, **kwargs):
+    """Call a Notion SDK method under the rate limit, backing off on HTTP 429."""
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        await _notion_throttle()
+        try:
+            return await fn(**kwargs)
+        except Exception as e:
+            if getattr(e, "status", None) != 429 or attempt == NOTION_MAX_RETRIES:
+                raise
+            retry_after = getattr(e, "headers", {}).get("retry-after")
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = 2 ** attempt
+            delay += random.uniform(0, 0.5)
+            logger.warning("Notion rate limited, retrying in %.1fs", delay)
+            await asyncio.sleep(delay)
+
+
+async def _create_page(client, tracker: ConversationTracker) -> str:
+    """Create the Notion page with its session header and return the page id."""
+    call_type = "Phone Call" if tracker.is_phone_call else "WebRTC"
+    duration_str = tracker.get_duration_str()
+    
+    # Header blocks only; the transcript is appended separately in batches
+    blocks = [
+        {
+            "object": "block",
+            "type": "heading_2",
+            "heading_2": {
+                "rich_text": [{"type": "text", "text": {"content": "Session Details"}}]
+            }
+        },
+        {
+            "object": "block",
+            "type": "bulleted_list_item",
+            "bulleted_list_item": {
+                "rich_text": [{"type": "text", "text": {"content": f"Started: {tracker.start_time.strftime('%Y-%m-%d %H:%M:%S')}"}}]
+            }
+        },
+        {
+            "object": "block",
+            "type": "bulleted_list_item",
+            "bulleted_list_item": {
+                "rich_text": [{"type": "text", "text": {"content": f"Duration: {duration_str}"}}]
+            }
+        },
+        {
+            "object": "block",
+            "type": "bulleted_list_item",
+            "bulleted_list_item": {
+                "rich_text": [{"type": "text", "text": {"content": f"Type: {call_type}"}}]
+            }
+        }
+    ]
+    if tracker.dropped:
+        blocks.append({
+            "object": "block",
+            "type": "bulleted_list_item",
+            "bulleted_list_item": {
+                "rich_text": [{"type": "text", "text": {"content": f"Earlier messages omitted: {tracker.dropped}"}}]
+            }
+        })
+    blocks += [
+        {
+            "object": "block",
+            "type": "divider",
+            "divider": {}
+        },
+        {
+            "object": "block",
+            "type": "heading_2",
+            "heading_2": {
+                "rich_text": [{"type": "text", "text": {"content": "Conversation"}}]
+            }
+        }
+    ]
+    
+    page = await _notion_call(
+        client.pages.create,
+        parent={"database_id": NOTION_DATABASE_ID},
+        properties={
+            "Name": {"title": [{"text": {"content": tracker.user_name or "Unknown Caller"}}]},
+            "Date": {"date": {"start": tracker.start_time.isoformat()}},
+            "Type": {"select": {"name": call_type}},
+            "Duration": {"rich_text": [{"text": {"content": duration_str}}]},
+            "Status": {"select": {"name": "Completed"}}
+        },
+        children=blocks
+    )
+    return page["id"]
+
+
+def _iter_message_blocks(messages: Iterable[TranscriptMessage]):
+    """Yield transcript paragraph blocks in order.
+    
+    One paragraph per message; long messages continue in extra paragraphs
+    rather than being cut at the rich_text length limit.
+    """
+    for msg in messages:
+        line = _SPEAKER_PREFIX[msg.speaker] + msg.text
+        for i in range(0, len(line), NOTION_MAX_TEXT):
+            yield _paragraph_block(line[i:i + NOTION_MAX_TEXT])
+
+
+async def _append_messages(client, page_id: str, messages: Iterable[TranscriptMessage]):
+    """Append the transcript to a page, NOTION_MAX_CHILDREN blocks per request."""
+    # Blocks are built one batch at a time, so only a single request's worth
+    # is alive at once. Appends run in order so the transcript reads top to bottom.
+    blocks = _iter_message_blocks(messages)
+    while chunk := list(islice(blocks, NOTION_MAX_CHILDREN)):
+        await _notion_call(client.blocks.children.append, block_id=page_id, children=chunk)
+
+
+async def _save_notion_page(tracker: ConversationTracker):
+    """Write a conversation to Notion."""
+    page_title = tracker.user_name or "Unknown Caller"
+    try:
+        client = get_notion_client()
+        page_id = await _create_page(client, tracker)
+        await _append_messages(client, page_id, tracker.messages)
+        logger.info("✅ Saved conversation to Notion: %s", page_title)
+    except Exception as e:
+        logger.error("Failed to save to Notion: %s", e)
+
+
+async def notion_worker():
+    """Drain the Notion queue, writing one conversation at a time."""
+    while True:
+        tracker = await notion_queue.get()
+        try:
+            # Shielded so cancelling the worker doesn't abandon a half-written page
+            await asyncio.shield(_save_notion_page(tracker))
+        finally:
+            notion_queue.task_done()
+
+
+def start_notion_worker():
+    """Start the background Notion worker if it isn't already running."""
+    global _notion_worker_task
+    if _notion_worker_task is None or _notion_worker_task.done():
+        _notion_worker_task = asyncio.create_task(notion_worker())
 
 
 def save_to_notion(tracker: ConversationTracker):
-    """Save conversation to Notion database."""
-    if not notion_client or not NOTION_DATABASE_ID:
+    """Queue a conversation to be saved to the Notion database."""
+    if not NOTION_TOKEN or not NOTION_DATABASE_ID:
         logger.warning("Notion not configured - skipping conversation save")
         return
     
-    try:
-        # Build page properties
-        call_type = "Phone Call" if tracker.is_phone_call else "WebRTC"
-        page_title = tracker.user_name or "Unknown Caller"
-        
-        # Create page content blocks
-        blocks = [
-            {
-                "object": "block",
-                "type": "heading_2",
-                "heading_2": {
-                    "rich_text": [{"type": "text", "text": {"content": "Session Details"}}]
-                }
-            },
-            {
-                "object": "block",
-                "type": "bulleted_list_item",
-                "bulleted_list_item": {
-                    "rich_text": [{"type": "text", "text": {"content": f"Started: {tracker.start_time.strftime('%Y-%m-%d %H:%M:%S')}"}}]
-                }
-            },
-            {
-                "object": "block",
-                "type": "bulleted_list_item",
-                "bulleted_list_item": {
-                    "rich_text": [{"type": "text", "text": {"content": f"Duration: {tracker.get_duration_str()}"}}]
-                }
-            },
-            {
-                "object": "block",
-                "type": "bulleted_list_item",
-                "bulleted_list_item": {
-                    "rich_text": [{"type": "text", "text": {"content": f"Type: {call_type}"}}]
-                }
-            },
-            {
-                "object": "block",
-                "type": "divider",
-                "divider": {}
-            },
-            {
-                "object": "block",
-                "type": "heading_2",
-                "heading_2": {
-                    "rich_text": [{"type": "text", "text": {"content": "Conversation"}}]
-                }
-            }
-        ]
-        
-        # Add each message as a paragraph block
-        for msg in tracker.messages:
-            speaker_text = f"[{msg['speaker']}] {msg['text']}"
-            blocks.append({
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [{"type": "text", "text": {"content": speaker_text[:2000]}}]  # Notion limit
-                }
-            })
-        
-        # Create the page in the database
-        notion_client.pages.create(
-            parent={"database_id": NOTION_DATABASE_ID},
-            properties={
-                "Name": {"title": [{"text": {"content": page_title}}]},
-                "Date": {"date": {"start": tracker.start_time.isoformat()}},
-                "Type": {"select": {"name": call_type}},
-                "Duration": {"rich_text": [{"text": {"content": tracker.get_duration_str()}}]},
-                "Status": {"select": {"name": "Completed"}}
-            },
-            children=blocks
-        )
-        
-        logger.info(f"✅ Saved conversation to Notion: {page_title}")
-        
-    except Exception as e:
-        logger.error(f"Failed to save to Notion: {e}")
+    if len(tracker.messages) < NOTION_MIN_MESSAGES:
+        logger.info("Skipping Notion save for near-empty session (%d messages)", len(tracker.messages))
+        return
+    
+    elapsed = tracker.elapsed_seconds()
+    if elapsed < NOTION_MIN_DURATION:
+        logger.info("Skipping Notion save for short session (%.1fs)", elapsed)
+        return
+    
+    # Freeze the duration at hangup rather than when the worker gets to it
+    tracker.get_duration_str()
+    notion_queue.put_nowait(tracker)
 
-# Default system prompt when no custom persona is provided
-DEFAULT_SYSTEM_PROMPT = """You are Vocalize, a helpful, professional AI voice assistant. 
+# Default system prompt when no custom persona is provided. The web sections
+# are only included when the web tools are offered (TAVILY_API_KEY set).
+_DEFAULT_PROMPT_INTRO = """You are Vocalize, a helpful, professional AI voice assistant. 
 You are concise, friendly, and speak naturally like a human.
 Keep your responses brief and conversational - this is a voice call, not a text chat.
 NEVER use any markdown formatting like **bold**, *italic*, __, ##, bullets, or any special symbols - everything you say will be spoken aloud and displayed as-is.
@@ -251,7 +509,9 @@ Be warm, personable, and helpful.
 
 
 
-WEB SEARCH CAPABILITY:
+"""
+
+_DEFAULT_PROMPT_WEB_TOOLS = """WEB SEARCH CAPABILITY:
 - You have access to a search_web tool for real-time information.
 - Use it when users ask about: current events, news, weather, stock prices, sports scores, or anything that requires up-to-date information.
 - When you need to search, briefly tell the user "Let me look that up for you" then use the tool.
@@ -263,7 +523,9 @@ WEB PAGE READING CAPABILITY:
 - Say "Let me read that page for you" before using the tool.
 - Summarize the key points in a conversational way.
 
-EMAIL CAPABILITY - MANDATORY TOOL USE:
+"""
+
+_DEFAULT_PROMPT_RULES = """EMAIL CAPABILITY - MANDATORY TOOL USE:
 - When user says "send me", "email me", "message me", or wants info sent to their email:
   IMMEDIATELY call request_email_input() tool. Do NOT respond with words first.
 - NEVER say "Could you share your email?" or "What's your email address?" - THIS IS FORBIDDEN.
@@ -278,6 +540,12 @@ IMPORTANT RULES YOU MUST FOLLOW:
 - Never mention Llama, GPT, or any other model names.
 - Simply present yourself as Vocalize, a voice assistant, without revealing technical details about your underlying technology."""
 
+DEFAULT_SYSTEM_PROMPT = (
+    _DEFAULT_PROMPT_INTRO
+    + (_DEFAULT_PROMPT_WEB_TOOLS if TAVILY_API_KEY else "")
+    + _DEFAULT_PROMPT_RULES
+)
+
 # ============================================================
 # 📞 PHONE AGENT CUSTOM INSTRUCTIONS (EDIT LINES 64-68)
 # ============================================================
@@ -298,64 +566,32 @@ do not speak for more than 5 seconds.
 # ============================================================
 # Your Vercel app URL for logo/icons
 APP_PUBLIC_URL = os.environ.get("APP_PUBLIC_URL", "https://karans-call-agent-vocalize-ai.vercel.app")
+# Logo - the icons.png file from your Vercel app
+_LOGO_URL = escape(f"{APP_PUBLIC_URL}/icons.png")
 
-def build_html_email(
-    subject: str, 
-    body: str, 
-    sources: list[dict] = None, 
-    images: list[str] = None,
-    user_name: str = None
-) -> tuple[str, str]:
-    """Build a styled HTML email with inline CSS (dark theme like Notion/Simplilearn).
-    
-    Args:
-        subject: Email subject (used in header)
-        body: Main email content
-        sources: List of {"title": str, "url": str} from Tavily search
-        images: List of image URLs to embed
-        user_name: Optional user name for personalized greeting
-        
-    Returns:
-        Tuple of (html_content, plain_text_fallback)
-    """
-    # Convert body text with line breaks to HTML paragraphs
-    body_paragraphs = body.replace('\n\n', '</p><p style="margin: 0 0 16px 0; line-height: 1.6;">').replace('\n', '<br>')
-    
-    # Personalized greeting
-    greeting = f"Hi {user_name}," if user_name else "Hello,"
-    
-    # Build sources section HTML
-    sources_html = ""
-    if sources and len(sources) > 0:
-        source_items = ""
-        for src in sources[:5]:  # Max 5 sources
-            title = src.get("title", "Source")
-            url = src.get("url", "#")
-            # Extract domain for favicon
-            domain = url.split("//")[-1].split("/")[0] if "//" in url else url.split("/")[0]
-            favicon_url = f"https://www.google.com/s2/favicons?domain={domain}&sz=32"
-            
-            source_items += f'''
+# HTML email templates, parsed once at import. build_html_email only
+# substitutes the per-message slots.
+_SOURCE_ITEM_TEMPLATE = Template('''
             <tr>
                 <td style="padding: 12px 16px; background: #2a2a2a; border-radius: 8px; margin-bottom: 8px;">
                     <table cellpadding="0" cellspacing="0" border="0" width="100%">
                         <tr>
                             <td width="32" valign="top">
-                                <img src="{favicon_url}" width="20" height="20" alt="" style="border-radius: 4px; margin-right: 12px;">
+                                <img src="$favicon_url" width="20" height="20" alt="" style="border-radius: 4px; margin-right: 12px;">
                             </td>
                             <td>
-                                <a href="{url}" style="color: #60a5fa; text-decoration: none; font-size: 14px; font-weight: 500;">{title}</a>
+                                <a href="$url" style="color: #60a5fa; text-decoration: none; font-size: 14px; font-weight: 500;">$title</a>
                                 <br>
-                                <span style="color: #6b7280; font-size: 12px;">{domain}</span>
+                                <span style="color: #6b7280; font-size: 12px;">$domain</span>
                             </td>
                         </tr>
                     </table>
                 </td>
             </tr>
             <tr><td height="8"></td></tr>
-            '''
-        
-        sources_html = f'''
+            ''')
+
+_SOURCES_SECTION_TEMPLATE = Template('''
         <tr>
             <td style="padding: 24px 0 12px 0;">
                 <h3 style="margin: 0; color: #9ca3af; font-size: 14px; font-weight: 600; text-transform: uppercase; letter-spacing: 0.5px;">
@@ -366,26 +602,21 @@ def build_html_email(
         <tr>
             <td>
                 <table cellpadding="0" cellspacing="0" border="0" width="100%">
-                    {source_items}
+                    $source_items
                 </table>
             </td>
         </tr>
-        '''
-    
-    # Build images section HTML
-    images_html = ""
-    if images and len(images) > 0:
-        image_items = ""
-        for img_url in images[:3]:  # Max 3 images
-            image_items += f'''
+        ''')
+
+_IMAGE_ITEM_TEMPLATE = Template('''
             <tr>
                 <td style="padding: 8px 0;">
-                    <img src="{img_url}" alt="Related image" style="max-width: 100%; height: auto; border-radius: 12px; display: block;">
+                    <img src="$img_url" alt="Related image" style="max-width: 100%; height: auto; border-radius: 12px; display: block;">
                 </td>
             </tr>
-            '''
-        
-        images_html = f'''
+            ''')
+
+_IMAGES_SECTION_TEMPLATE = Template('''
         <tr>
             <td style="padding: 24px 0 12px 0;">
                 <h3 style="margin: 0; color: #9ca3af; font-size: 14px; font-weight: 600; text-transform: uppercase; letter-spacing: 0.5px;">
@@ -393,30 +624,26 @@ def build_html_email(
                 </h3>
             </td>
         </tr>
-        {image_items}
-        '''
-    
-    # Logo URL - use the icons.png file from your Vercel app
-    logo_url = f"{APP_PUBLIC_URL}/icons.png"
-    
-    # Complete HTML email template with embedded Google Fonts for cursive styling
-    html = f'''
+        $image_items
+        ''')
+
+_EMAIL_SHELL = '''
 <!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-    <title>{subject}</title>
+    <title>$subject</title>
     <style type="text/css">
         @import url('https://fonts.googleapis.com/css2?family=Satisfy&display=swap');
-        .brand-font {{
+        .brand-font {
             font-family: 'Satisfy', 'Brush Script MT', 'Lucida Handwriting', cursive !important;
-        }}
+        }
     </style>
     <!--[if mso]>
     <style type="text/css">
-        .brand-font {{ font-family: Georgia, cursive !important; }}
+        .brand-font { font-family: Georgia, cursive !important; }
     </style>
     <![endif]-->
 </head>
@@ -434,7 +661,7 @@ def build_html_email(
                                 <tr>
                                     <td width="52">
                                         <div style="width: 44px; height: 44px; background: linear-gradient(135deg, #f43f5e, #e11d48); border-radius: 12px; display: flex; align-items: center; justify-content: center;">
-                                            <img src="{logo_url}" width="44" height="44" alt="Vocalize AI" style="border-radius: 12px; display: block;">
+                                            <img src="$logo_url" width="44" height="44" alt="Vocalize AI" style="border-radius: 12px; display: block;">
                                         </div>
                                     </td>
                                     <td style="padding-left: 14px;">
@@ -451,23 +678,23 @@ def build_html_email(
                         <td style="padding: 32px;">
                             <!-- Greeting -->
                             <p style="margin: 0 0 24px 0; color: #f3f4f6; font-size: 17px; font-weight: 500;">
-                                {greeting}
+                                $greeting
                             </p>
                             
                             <!-- Subject as Heading -->
                             <h1 style="margin: 0 0 24px 0; color: #ffffff; font-size: 28px; font-weight: 700; line-height: 1.3;">
-                                {subject}
+                                $subject
                             </h1>
                             
                             <!-- Body Content -->
                             <div style="margin: 0 0 16px 0; color: #e5e7eb; font-size: 16px; line-height: 1.7;">
-                                {body_paragraphs}
+                                $body_paragraphs
                             </div>
                             
                             <!-- Sources Section -->
                             <table cellpadding="0" cellspacing="0" border="0" width="100%">
-                                {sources_html}
-                                {images_html}
+                                $sources_html
+                                $images_html
                             </table>
                         </td>
                     </tr>
@@ -497,14 +724,97 @@ def build_html_email(
 </body>
 </html>
 '''
+
+# The logo URL is fixed at startup, so it's filled in once here rather than
+# being a per-email slot
+_EMAIL_TEMPLATE = Template(Template(_EMAIL_SHELL).safe_substitute(logo_url=_LOGO_URL))
+
+
+# Blank lines start a new paragraph, single newlines become <br>; one regex
+# scan handles both (alternation tries the longer break first)
+_BODY_BREAKS = {
+    "\n\n": '</p><p style="margin: 0 0 16px 0; line-height: 1.6;">',
+    "\n": "<br>",
+}
+_BODY_BREAK_RE = re.compile(r"\n\n|\n")
+
+
+@lru_cache(maxsize=1024)
+def _source_link(url: str) -> tuple[str, str, str]:
+    """Return the HTML-escaped (url, domain, favicon_url) for a source link.
+    
+    Cached because the same sources repeat across emails.
+    """
+    # Tavily URLs normally carry a scheme; fall back to the leading path segment
+    domain = urlsplit(url).netloc or url.split("/")[0]
+    favicon_url = f"https://www.google.com/s2/favicons?domain={domain}&sz=32"
+    return escape(url), escape(domain), escape(favicon_url)
+
+
+def build_html_email(
+    subject: str, 
+    body: str, 
+    sources: list[dict] = None, 
+    images: list[str] = None,
+    user_name: str = None
+) -> tuple[str, str]:
+    """Build a styled HTML email with inline CSS (dark theme like Notion/Simplilearn).
+    
+    Args:
+        subject: Email subject (used in header)
+        body: Main email content
+        sources: List of {"title": str, "url": str} from Tavily search
+        images: List of image URLs to embed
+        user_name: Optional user name for personalized greeting
+        
+    Returns:
+        Tuple of (html_content, plain_text_fallback)
+    """
+    # Convert body text with line breaks to HTML paragraphs (escaped first,
+    # since subject, body and name come from the LLM/user)
+    body_paragraphs = _BODY_BREAK_RE.sub(lambda m: _BODY_BREAKS[m[0]], escape(body))
+    
+    # Personalized greeting
+    greeting = f"Hi {user_name}," if user_name else "Hello,"
+    
+    # Build sources section HTML
+    sources_html = ""
+    if sources:
+        source_items = []
+        for src in sources[:5]:  # Max 5 sources
+            url, domain, favicon_url = _source_link(src.get("url", "#"))
+            source_items.append(_SOURCE_ITEM_TEMPLATE.substitute(
+                favicon_url=favicon_url,
+                url=url,
+                title=escape(src.get("title", "Source")),
+                domain=domain,
+            ))
+        sources_html = _SOURCES_SECTION_TEMPLATE.substitute(source_items="".join(source_items))
+    
+    # Build images section HTML
+    images_html = ""
+    if images:
+        image_items = "".join(
+            _IMAGE_ITEM_TEMPLATE.substitute(img_url=escape(img_url))
+            for img_url in images[:3]  # Max 3 images
+        )
+        images_html = _IMAGES_SECTION_TEMPLATE.substitute(image_items=image_items)
+    
+    html = _EMAIL_TEMPLATE.substitute(
+        subject=escape(subject),
+        greeting=escape(greeting),
+        body_paragraphs=body_paragraphs,
+        sources_html=sources_html,
+        images_html=images_html,
+    )
     
     # Plain text fallback
-    plain_text = f"{greeting}\n\n{subject}\n\n{body}"
+    parts = [greeting, "\n\n", subject, "\n\n", body]
     if sources:
-        plain_text += "\n\nSources:\n"
-        for src in sources[:5]:
-            plain_text += f"- {src.get('title', 'Source')}: {src.get('url', '')}\n"
-    plain_text += "\n---\nSent by Vocalize AI"
+        parts.append("\n\nSources:\n")
+        parts.extend(f"- {src.get('title', 'Source')}: {src.get('url', '')}\n" for src in sources[:5])
+    parts.append("\n---\nSent by Vocalize AI")
+    plain_text = "".join(parts)
     
     return html, plain_text
 
@@ -512,6 +822,55 @@ def build_html_email(
 # ============================================================
 # 📧 RESEND EMAIL SENDER (Cloud-compatible, works on Railway)
 # ============================================================
+_EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', re.ASCII)
+
+
+class ResendMailer:
+    """Sends emails with one POST each to Resend's REST API.
+    
+    Requests share one keep-alive aiohttp session, opened on first use.
+    """
+    
+    def __init__(self, shutdown_timeout: float = 30.0):
+        self.shutdown_timeout = shutdown_timeout
+        self._http: aiohttp.ClientSession | None = None
+        self._in_flight: set[asyncio.Task] = set()
+    
+    async def aclose(self):
+        """Let sends already in progress finish (bounded), then close the session."""
+        if self._in_flight:
+            await asyncio.wait(self._in_flight, timeout=self.shutdown_timeout)
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+    
+    async def send(self, params: dict) -> dict:
+        """Send one email; returns Resend's {"id": ...}."""
+        task = asyncio.current_task()
+        self._in_flight.add(task)
+        try:
+            async with self._session().post(RESEND_EMAILS_URL, data=orjson.dumps(params)) as resp:
+                if resp.status >= 400:
+                    raise RuntimeError(f"Resend API error {resp.status}: {await resp.text()}")
+                return orjson.loads(await resp.read())
+        finally:
+            self._in_flight.discard(task)
+    
+    def _session(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                headers={
+                    "Authorization": f"Bearer {RESEND_API_KEY}",
+                    "Content-Type": "application/json",
+                },
+                connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        return self._http
+
+
+email_sender = ResendMailer()
+
 async def send_email_via_resend(
     to_email: str, 
     subject: str, 
@@ -539,9 +898,8 @@ async def send_email_via_resend(
         logger.warning("Resend API key not configured")
         return {"success": False, "message": "Email service is not configured."}
     
-    # Validate email format
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    if not re.match(email_pattern, to_email):
+    # Validate email format (cheap '@' check first, then the full pattern)
+    if '@' not in to_email or not _EMAIL_RE.fullmatch(to_email):
         return {"success": False, "message": f"Invalid email address: {to_email}"}
     
     try:
@@ -559,20 +917,18 @@ async def send_email_via_resend(
             plain_text = body
         
         # Send via Resend API (HTTP-based, no SMTP ports needed)
-        def send_sync():
-            params: resend.Emails.SendParams = {
-                "from": RESEND_FROM_EMAIL,
-                "to": [to_email],
-                "subject": subject,
-                "text": plain_text,
-            }
-            if html_content:
-                params["html"] = html_content
-            return resend.Emails.send(params)
+        params = {
+            "from": RESEND_FROM_EMAIL,
+            "to": [to_email],
+            "subject": subject,
+            "text": plain_text,
+        }
+        if html_content:
+            params["html"] = html_content
         
-        result = await asyncio.get_event_loop().run_in_executor(None, send_sync)
+        result = await email_sender.send(params)
         
-        logger.info(f"✅ Email sent successfully to {to_email}, id: {result.get('id', 'N/A')}")
+        logger.info("✅ Email sent successfully to %s, id: %s", to_email, result.get("id", "N/A"))
         return {"success": True, "message": f"Email sent successfully to {to_email}"}
         
     except Exception as e:
@@ -581,6 +937,28 @@ async def send_email_via_resend(
 
 
 
+# ============================================================
+# 📡 FRONTEND DATA MESSAGES (pre-encoded, payloads never change)
+# ============================================================
+_MSG_TOOL_USE_SEARCH = b'{"type":"tool_use","tool":"search_web"}'
+_MSG_TOOL_USE_READ = b'{"type":"tool_use","tool":"read_webpage"}'
+_MSG_REQUEST_EMAIL = b'{"type":"request_email_input"}'
+_MSG_CLOSE_POPUP = b'{"type":"close_email_popup"}'
+_MSG_ACTIONS = {
+    action: orjson.dumps({"type": "action", "action": action})
+    for action in ("wave", "nod", "wink", "wagtail")
+}
+
+# Popup email submissions: raw marker for skipping other data messages, and
+# the reply instructions once an address arrives
+_EMAIL_RESPONSE_MARKER = b'"email_response"'
+_EMAIL_RECEIVED_INSTRUCTIONS = (
+    "IMPORTANT: The user has typed their email address in the popup box. Their email is: {email}. "
+    "Tell them you received their email ({email}) and now ask them for the email subject line. "
+    "Make sure to confirm the email address you received."
+)
+
+
 # Hangup function as per LiveKit documentation
 async def hangup_call():
     """End the call for all participants by deleting the room."""
@@ -593,12 +971,28 @@ async def hangup_call():
     )
 
 
+# Avatar gesture guidance appended to every agent's instructions
+_GESTURE_INSTRUCTIONS = """
+AVATAR GESTURES (USE THESE):
+You have an animated avatar. To perform a gesture, you MUST call the `perform_action` tool.
+Do NOT output tags like [Wave] in your speech. ALWAYS use the tool.
+
+Available actions:
+- 'wave' : Wave hello/goodbye
+- 'nod' : Nod in agreement  
+- 'wink' : Playful wink
+- 'wagtail' : Show excitement
+
+Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
+"""
+
+
 class VocalizeAgent(Agent):
     """Custom voice agent with dynamic instructions from frontend settings."""
     
     def __init__(self, instructions: str, user_name: str = "", is_phone_call: bool = False) -> None:
         # Log the instructions being used
-        logger.info(f"VocalizeAgent init with instructions: {instructions[:150]}...")
+        logger.info("VocalizeAgent init with instructions: %.150s...", instructions)
         
         # Personalize the instructions with user's name if provided
         if user_name:
@@ -607,82 +1001,175 @@ class VocalizeAgent(Agent):
 
         # INJECT AVATAR GESTURE INSTRUCTIONS (Tricking the LLM to support gestures)
         # This ensures gestures work even if the prompt comes from the frontend
-        gesture_instructions = """
-AVATAR GESTURES (USE THESE):
-You have an animated avatar. To perform a gesture, you MUST call the `perform_action` tool.
-Do NOT output tags like [Wave] in your speech. ALWAYS use the tool.
-
-Available actions:
-- 'wave' : Wave hello/goodbye
-- 'nod' : Nod in agreement  
-- 'wink' : Playful wink
-- 'wagtail' : Show excitement
-
-Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
-"""
-        instructions = f"{instructions}\n{gesture_instructions}"
+        instructions = f"{instructions}\n{_GESTURE_INSTRUCTIONS}"
         
         super().__init__(instructions=instructions)
         self.user_name = user_name
         self.is_phone_call = is_phone_call
         self.pending_email = None  # Stores email received from popup
+        self._job_ctx = None  # Resolved lazily by _ctx()
+        self._email_tasks: set[asyncio.Task] = set()  # Research emails being delivered
+    
+    def _ctx(self):
+        """Get the job context, looked up once (an agent lives for exactly one job)."""
+        if self._job_ctx is None:
+            self._job_ctx = get_job_context()
+        return self._job_ctx
     
     @function_tool
-    async def end_call(self, ctx: RunContext, confirm: bool = False):
-        """ONLY use this to end the phone call when the user EXPLICITLY says goodbye.
-        
-        CRITICAL - DO NOT CALL THIS FUNCTION UNLESS:
-        - User says "goodbye", "bye", "bye bye", "talk to you later", "gotta go"
-        - User explicitly says "hang up", "end the call", or "disconnect"
+    async def send_email(self, ctx: RunContext, recipient_email: str, subject: str, message: str):
+        """Send a beautifully styled HTML email to a specified recipient.
         
-        DO NOT call this function:
-        - During normal conversation
-        - When there is silence or a pause
-        - When the user finishes discussing a topic
-        - When you are unsure what the user wants
-        - At any point unless the user clearly wants to end the call
+        Use this when the user wants to send a regular email. The email will be styled
+        with a dark theme and the Vocalize AI branding. Always confirm the recipient email,
+        subject, and message with the user before calling this function.
         
         Args:
-            confirm: MUST be True to actually end the call. Default is False for safety.
+            recipient_email: The email address to send to (e.g., user@example.com)
+            subject: The subject line of the email
+            message: The body content of the email
         """
-        if not confirm:
-            logger.info("end_call called but confirm=False, ignoring")
-            return
+        logger.info("Sending styled email to %s with subject: %s", recipient_email, subject)
         
-        logger.info("User explicitly said goodbye - ending call")
-        await ctx.wait_for_playout()
-        await hangup_call()
+        result = await send_email_via_resend(
+            to_email=recipient_email,
+            subject=subject,
+            body=message,
+            user_name=self.user_name if self.user_name else None
+        )
+        
+        if result["success"]:
+            return f"Great news! I've successfully sent a beautifully styled email to {recipient_email}."
+        else:
+            return f"I'm sorry, I couldn't send the email. {result['message']}"
     
     @function_tool
-    async def search_web(self, ctx: RunContext, query: str):
-        """Search the web for current news, weather, sports scores, stock prices, or any real-time information.
-        
+    async def request_email_input(self, ctx: RunContext, confirm: bool = True):
+        """MUST USE THIS TOOL when user wants to receive information via email.
+        
+        TRIGGER PHRASES - Call this tool when user says:
+        - "send me", "email me", "message me", "mail me"
+        - "send it to my email", "send the details", "send that to me"
+        - Any request to receive information via email
+        
+        DO NOT ask "what's your email?" - use this tool instead to show a popup.
+        After calling, say ONE sentence then STOP TALKING. Wait for email submission.
+        
         Args:
-            query: What to search for
+            confirm: Set to True to open the popup.
         """
-        if not tavily_client:
-            logger.warning("Tavily API key not configured - search unavailable")
-            return "Web search is not available right now."
+        if not confirm:
+            return "Okay, speak your email address instead."
         
         try:
-            logger.info(f"Searching web for: {query}")
+            job_ctx = self._ctx()
+            if job_ctx is None:
+                logger.error("Could not get job context for email input request")
+                return "I couldn't open the input. Please speak your email address."
+            
+            data = _MSG_REQUEST_EMAIL
+            await job_ctx.room.local_participant.publish_data(data, reliable=True)
+            
+            logger.info("Sent request_email_input message to frontend")
+            # Short response - agent should STOP talking after saying this
+            return "Email input opened. Type your email and submit. [STOP TALKING NOW - WAIT SILENTLY]"
+            
+        except Exception as e:
+            logger.error(f"Failed to request email input: {e}")
+            return "I couldn't open the input. Please speak your email address."
+            
+    @function_tool
+    async def perform_action(self, ctx: RunContext, action: str):
+        """Perform an avatar gesture/action.
+        
+        Use this tool to make your avatar move. Call it BEFORE you speak the corresponding text.
+        
+        Args:
+            action: The action to perform. Must be one of: 'wave', 'nod', 'wink', 'wagtail'
+        """
+        action = action.lower()
+        data = _MSG_ACTIONS.get(action)
+        
+        if data is None:
+            return f"Action '{action}' is not supported. Supported actions: {', '.join(_MSG_ACTIONS)}"
+            
+        try:
+            job_ctx = self._ctx()
+            if job_ctx:
+                await job_ctx.room.local_participant.publish_data(data, reliable=True)
+                logger.info("Sent avatar action command: %s", action)
+                return "Action performed."
+            return "Could not perform action (no room context)."
+        except Exception as e:
+            logger.error(f"Failed to perform action {action}: {e}")
+            return "Failed to perform action."
+    
+    @function_tool
+    async def close_email_popup(self, ctx: RunContext, confirm: bool = True):
+        """Close the email input popup on the user's screen.
+        
+        Use this when the user asks to close, cancel, or dismiss the email input popup.
+        For example if they say "never mind", "cancel", "close the popup", etc.
+        
+        Args:
+            confirm: Set to True to close the popup. Default is True.
+        """
+        if not confirm:
+            return "Okay, the popup will stay open."
+        
+        try:
+            job_ctx = self._ctx()
+            if job_ctx is None:
+                return "The popup should already be closed."
+            
+            data = _MSG_CLOSE_POPUP
+            await job_ctx.room.local_participant.publish_data(data, reliable=True)
+            
+            logger.info("Sent close_email_popup message to frontend")
+            return "I've closed the email input. Would you like to speak your email address instead, or do something else?"
+            
+        except Exception as e:
+            logger.error(f"Failed to close email popup: {e}")
+            return "I couldn't close the popup. You can click the X button on the popup to close it."
+
+
+class ResearchVocalizeAgent(VocalizeAgent):
+    """VocalizeAgent with the Tavily-backed web tools.
+    
+    Only used when TAVILY_API_KEY is set, so the LLM is never offered tools that
+    can't run.
+    """
+    
+    @function_tool
+    async def search_web(self, ctx: RunContext, query: str):
+        """Search the web for current news, weather, sports scores, stock prices, or any real-time information.
+        
+        Args:
+            query: What to search for
+        """
+        try:
+            logger.info("Searching web for: %s", query)
             
             # Send tool_use message to frontend (for sound effect)
             try:
-                job_ctx = get_job_context()
+                job_ctx = self._ctx()
                 if job_ctx:
-                    data = json.dumps({"type": "tool_use", "tool": "search_web"}).encode()
+                    data = _MSG_TOOL_USE_SEARCH
                     await job_ctx.room.local_participant.publish_data(data, reliable=True)
                     logger.info("Sent tool_use notification to frontend")
             except Exception as e:
-                logger.debug(f"Could not send tool_use notification: {e}")
+                logger.debug("Could not send tool_use notification: %s", e)
             
             # Use Tavily async search - fast and optimized for AI
-            response = await tavily_client.search(
-                query=query,
-                search_depth="basic",
-                max_results=5,
-                include_answer=True,
+            response = await _cached_tavily(
+                f"search:basic:{query.strip().lower()}",
+                TAVILY_SEARCH_TTL,
+                lambda: tavily_client.search(
+                    query=query,
+                    search_depth="basic",
+                    max_results=5,
+                    include_answer=True,
+                ),
             )
             
             # Extract source URLs for frontend display
@@ -697,23 +1184,22 @@ Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
             # Send sources to frontend via data channel
             if sources:
                 try:
-                    job_ctx = get_job_context()
+                    job_ctx = self._ctx()
                     if job_ctx:
-                        data = json.dumps({"type": "search_sources", "sources": sources}).encode()
+                        data = orjson.dumps({"type": "search_sources", "sources": sources})
                         await job_ctx.room.local_participant.publish_data(data, reliable=True)
-                        logger.info(f"Sent {len(sources)} search sources to frontend")
+                        logger.info("Sent %d search sources to frontend", len(sources))
                 except Exception as e:
                     logger.error(f"Failed to send sources to frontend: {e}")
             
             # Extract the answer or compile results
             if response.get("answer"):
                 result = response["answer"]
-                logger.info(f"Tavily returned answer: {result[:100]}...")
+                logger.info("Tavily returned answer: %.100s...", result)
             else:
                 if results:
-                    summaries = [r.get("content", "")[:200] for r in results[:2]]
-                    result = " ".join(summaries)
-                    logger.info(f"Tavily returned {len(results)} results")
+                    result = " ".join(c[:200] for r in results[:2] if (c := r.get("content")))
+                    logger.info("Tavily returned %d results", len(results))
                 else:
                     result = "No results found for that query."
                     logger.info("Tavily returned no results")
@@ -733,25 +1219,25 @@ Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
         Args:
             url: The URL of the webpage to read
         """
-        if not tavily_client:
-            logger.warning("Tavily API key not configured - page reading unavailable")
-            return "Web page reading is not available right now."
-        
         try:
-            logger.info(f"Extracting content from: {url}")
+            logger.info("Extracting content from: %s", url)
             
             # Send tool_use message to frontend (for sound effect)
             try:
-                job_ctx = get_job_context()
+                job_ctx = self._ctx()
                 if job_ctx:
-                    data = json.dumps({"type": "tool_use", "tool": "read_webpage"}).encode()
+                    data = _MSG_TOOL_USE_READ
                     await job_ctx.room.local_participant.publish_data(data, reliable=True)
                     logger.info("Sent tool_use notification to frontend for read_webpage")
             except Exception as e:
-                logger.debug(f"Could not send tool_use notification: {e}")
+                logger.debug("Could not send tool_use notification: %s", e)
             
             # Use Tavily extract to get page content
-            response = await tavily_client.extract(urls=[url])
+            response = await _cached_tavily(
+                f"extract:{url.strip()}",
+                TAVILY_EXTRACT_TTL,
+                lambda: tavily_client.extract(urls=[url]),
+            )
             
             # Extract the content
             results = response.get("results", [])
@@ -761,14 +1247,14 @@ Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
                 
                 # Send source to frontend via data channel (for favicon display)
                 try:
-                    job_ctx = get_job_context()
+                    job_ctx = self._ctx()
                     if job_ctx:
                         # Extract title from response or use URL as fallback
                         title = result_item.get("title", url)
                         sources = [{"url": url, "title": title}]
-                        data = json.dumps({"type": "search_sources", "sources": sources}).encode()
+                        data = orjson.dumps({"type": "search_sources", "sources": sources})
                         await job_ctx.room.local_participant.publish_data(data, reliable=True)
-                        logger.info(f"Sent webpage source to frontend: {url}")
+                        logger.info("Sent webpage source to frontend: %s", url)
                 except Exception as e:
                     logger.error(f"Failed to send source to frontend: {e}")
                 
@@ -776,7 +1262,7 @@ Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
                     # Limit content length for voice response
                     if len(content) > 2000:
                         content = content[:2000] + "... The page has more content, but I've summarized the key parts."
-                    logger.info(f"Extracted {len(content)} characters from {url}")
+                    logger.info("Extracted %d characters from %s", len(content), url)
                     return content
                 else:
                     return "I couldn't extract any text content from that page."
@@ -787,33 +1273,6 @@ Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
             logger.error(f"Tavily extract failed: {e}")
             return "I couldn't read that webpage right now."
     
-    @function_tool
-    async def send_email(self, ctx: RunContext, recipient_email: str, subject: str, message: str):
-        """Send a beautifully styled HTML email to a specified recipient.
-        
-        Use this when the user wants to send a regular email. The email will be styled
-        with a dark theme and the Vocalize AI branding. Always confirm the recipient email,
-        subject, and message with the user before calling this function.
-        
-        Args:
-            recipient_email: The email address to send to (e.g., user@example.com)
-            subject: The subject line of the email
-            message: The body content of the email
-        """
-        logger.info(f"Sending styled email to {recipient_email} with subject: {subject}")
-        
-        result = await send_email_via_resend(
-            to_email=recipient_email,
-            subject=subject,
-            body=message,
-            user_name=self.user_name if self.user_name else None
-        )
-        
-        if result["success"]:
-            return f"Great news! I've successfully sent a beautifully styled email to {recipient_email}."
-        else:
-            return f"I'm sorry, I couldn't send the email. {result['message']}"
-    
     @function_tool
     async def send_research_email(self, ctx: RunContext, recipient_email: str, topic: str, additional_message: str = ""):
         """Search the web for information on a topic and send a styled email with sources and images.
@@ -834,19 +1293,26 @@ Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
             topic: What to research/search for
             additional_message: Optional extra message to include in the email
         """
-        if not tavily_client:
-            return "Web search is not available right now. I can't send a research email without it."
+        # The send itself finishes after we reply, so catch what we can up front
+        if not RESEND_API_KEY:
+            return "I'm sorry, I couldn't send the email. Email service is not configured."
+        if '@' not in recipient_email or not _EMAIL_RE.fullmatch(recipient_email):
+            return f"I'm sorry, I couldn't send the email. Invalid email address: {recipient_email}"
         
-        logger.info(f"Researching '{topic}' to send to {recipient_email}")
+        logger.info("Researching '%s' to send to %s", topic, recipient_email)
         
         try:
             # Search with Tavily including images
-            response = await tavily_client.search(
-                query=topic,
-                search_depth="advanced",  # More thorough search for email
-                max_results=5,
-                include_answer=True,
-                include_images=True,  # Get relevant images
+            response = await _cached_tavily(
+                f"search:advanced:{topic.strip().lower()}",
+                TAVILY_SEARCH_TTL,
+                lambda: tavily_client.search(
+                    query=topic,
+                    search_depth="advanced",  # More thorough search for email
+                    max_results=5,
+                    include_answer=True,
+                    include_images=True,  # Get relevant images
+                ),
             )
             
             # Extract the answer
@@ -855,8 +1321,7 @@ Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
                 # Compile from results if no direct answer
                 results = response.get("results", [])
                 if results:
-                    summaries = [r.get("content", "")[:300] for r in results[:3]]
-                    answer = " ".join(summaries)
+                    answer = " ".join(c[:300] for r in results[:3] if (c := r.get("content")))
                 else:
                     return "I couldn't find enough information on that topic to send an email."
             
@@ -876,117 +1341,91 @@ Example: To wave, call `perform_action(action='wave')` then say "Hello there!"
             if additional_message:
                 email_body = f"{additional_message}\n\n{answer}"
             
-            # Send the styled email with sources and images
-            result = await send_email_via_resend(
-                to_email=recipient_email,
-                subject=f"Research: {topic}",
-                body=email_body,
-                sources=sources,
-                images=images,
-                user_name=self.user_name if self.user_name else None
-            )
+            # Send the styled email in the background so the spoken reply doesn't
+            # wait on Resend; the user is told if delivery fails
+            task = asyncio.create_task(self._deliver_research_email(
+                ctx.session, recipient_email, topic, email_body, sources, images
+            ))
+            self._email_tasks.add(task)
+            task.add_done_callback(self._email_tasks.discard)
             
-            if result["success"]:
-                source_count = len(sources)
-                image_count = len(images)
-                return f"I've sent you a beautifully styled research email about '{topic}' to {recipient_email}. It includes {source_count} source links and {image_count} images."
-            else:
-                return f"I found the information but couldn't send the email. {result['message']}"
+            return f"I've sent you a beautifully styled research email about '{topic}' to {recipient_email}. It includes {len(sources)} source links and {len(images)} images."
                 
         except Exception as e:
             logger.error(f"Research email failed: {e}")
             return "I couldn't complete the research email. Please try again."
-
     
-    @function_tool
-    async def request_email_input(self, ctx: RunContext, confirm: bool = True):
-        """MUST USE THIS TOOL when user wants to receive information via email.
-        
-        TRIGGER PHRASES - Call this tool when user says:
-        - "send me", "email me", "message me", "mail me"
-        - "send it to my email", "send the details", "send that to me"
-        - Any request to receive information via email
-        
-        DO NOT ask "what's your email?" - use this tool instead to show a popup.
-        After calling, say ONE sentence then STOP TALKING. Wait for email submission.
-        
-        Args:
-            confirm: Set to True to open the popup.
-        """
-        if not confirm:
-            return "Okay, speak your email address instead."
-        
-        try:
-            job_ctx = get_job_context()
-            if job_ctx is None:
-                logger.error("Could not get job context for email input request")
-                return "I couldn't open the input. Please speak your email address."
-            
-            data = json.dumps({"type": "request_email_input"}).encode()
-            await job_ctx.room.local_participant.publish_data(data, reliable=True)
-            
-            logger.info("Sent request_email_input message to frontend")
-            # Short response - agent should STOP talking after saying this
-            return "Email input opened. Type your email and submit. [STOP TALKING NOW - WAIT SILENTLY]"
-            
-        except Exception as e:
-            logger.error(f"Failed to request email input: {e}")
-            return "I couldn't open the input. Please speak your email address."
-            
-    @function_tool
-    async def perform_action(self, ctx: RunContext, action: str):
-        """Perform an avatar gesture/action.
-        
-        Use this tool to make your avatar move. Call it BEFORE you speak the corresponding text.
-        
-        Args:
-            action: The action to perform. Must be one of: 'wave', 'nod', 'wink', 'wagtail'
-        """
-        valid_actions = {'wave', 'nod', 'wink', 'wagtail'}
-        action = action.lower()
+    async def _deliver_research_email(
+        self,
+        session: AgentSession,
+        recipient_email: str,
+        topic: str,
+        body: str,
+        sources: list[dict],
+        images: list[str],
+    ):
+        """Send a research email and speak up if delivery fails."""
+        result = await send_email_via_resend(
+            to_email=recipient_email,
+            subject=f"Research: {topic}",
+            body=body,
+            sources=sources,
+            images=images,
+            user_name=self.user_name if self.user_name else None
+        )
         
-        if action not in valid_actions:
-            return f"Action '{action}' is not supported. Supported actions: {', '.join(valid_actions)}"
-            
-        try:
-            job_ctx = get_job_context()
-            if job_ctx:
-                data = json.dumps({"type": "action", "action": action}).encode()
-                await job_ctx.room.local_participant.publish_data(data, reliable=True)
-                logger.info(f"Sent avatar action command: {action}")
-                return "Action performed."
-            return "Could not perform action (no room context)."
-        except Exception as e:
-            logger.error(f"Failed to perform action {action}: {e}")
-            return "Failed to perform action."
+        if not result["success"]:
+            try:
+                await session.generate_reply(
+                    instructions=f"Tell the user that the research email about '{topic}' to {recipient_email} "
+                    f"could not be sent after all. Reason: {result['message']}"
+                )
+            except Exception as e:
+                logger.error(f"Could not report research email failure: {e}")
+
+
+class PhoneVocalizeAgent(VocalizeAgent):
+    """VocalizeAgent for SIP calls, which adds the tool to hang up.
+    
+    Web sessions end when the browser disconnects, so only phone calls get end_call.
+    """
     
     @function_tool
-    async def close_email_popup(self, ctx: RunContext, confirm: bool = True):
-        """Close the email input popup on the user's screen.
+    async def end_call(self, ctx: RunContext, confirm: bool = False):
+        """ONLY use this to end the phone call when the user EXPLICITLY says goodbye.
         
-        Use this when the user asks to close, cancel, or dismiss the email input popup.
-        For example if they say "never mind", "cancel", "close the popup", etc.
+        CRITICAL - DO NOT CALL THIS FUNCTION UNLESS:
+        - User says "goodbye", "bye", "bye bye", "talk to you later", "gotta go"
+        - User explicitly says "hang up", "end the call", or "disconnect"
+        
+        DO NOT call this function:
+        - During normal conversation
+        - When there is silence or a pause
+        - When the user finishes discussing a topic
+        - When you are unsure what the user wants
+        - At any point unless the user clearly wants to end the call
         
         Args:
-            confirm: Set to True to close the popup. Default is True.
+            confirm: MUST be True to actually end the call. Default is False for safety.
         """
         if not confirm:
-            return "Okay, the popup will stay open."
+            logger.info("end_call called but confirm=False, ignoring")
+            return
         
-        try:
-            job_ctx = get_job_context()
-            if job_ctx is None:
-                return "The popup should already be closed."
-            
-            data = json.dumps({"type": "close_email_popup"}).encode()
-            await job_ctx.room.local_participant.publish_data(data, reliable=True)
-            
-            logger.info("Sent close_email_popup message to frontend")
-            return "I've closed the email input. Would you like to speak your email address instead, or do something else?"
-            
-        except Exception as e:
-            logger.error(f"Failed to close email popup: {e}")
-            return "I couldn't close the popup. You can click the X button on the popup to close it."
+        logger.info("User explicitly said goodbye - ending call")
+        await ctx.wait_for_playout()
+        await hangup_call()
+
+
+class ResearchPhoneVocalizeAgent(PhoneVocalizeAgent, ResearchVocalizeAgent):
+    """Phone agent with the web tools."""
+
+
+def _agent_class(is_phone_call: bool) -> type[VocalizeAgent]:
+    """Pick the agent class whose tools match the call type and configured services."""
+    if tavily_client:
+        return ResearchPhoneVocalizeAgent if is_phone_call else ResearchVocalizeAgent
+    return PhoneVocalizeAgent if is_phone_call else VocalizeAgent
 
 
 def parse_participant_metadata(metadata: str) -> dict:
@@ -995,85 +1434,99 @@ def parse_participant_metadata(metadata: str) -> dict:
         return {}
     
     try:
-        return json.loads(metadata)
-    except json.JSONDecodeError:
+        return orjson.loads(metadata)
+    except orjson.JSONDecodeError:
         logger.warning(f"Failed to parse participant metadata: {metadata}")
         return {}
 
 
+# Appended to every custom prompt: voice-specific guidance, then the email tool
+# instructions (ALWAYS included - critical for custom personas)
+_VOICE_TAIL = """
+
+Remember: This is a voice conversation. Keep responses concise and natural.
+Avoid special characters, emojis, or formatting that doesn't translate to speech."""
+
+_EMAIL_TAIL = """
+
+EMAIL CAPABILITY - MANDATORY:
+- When user says "send me", "email me", "message me" or wants info sent to email:
+  IMMEDIATELY call request_email_input() tool. Do NOT ask for email verbally.
+- NEVER say "what's your email?" - use the tool to show a popup instead.
+- After tool call, say ONE sentence then STOP TALKING. Wait silently."""
+
+_VOICE_SUFFIX = _VOICE_TAIL + _EMAIL_TAIL
+
+
+@lru_cache(maxsize=256)
+def _assemble_system_prompt(persona: str, business_details: str) -> str:
+    """Assemble a custom prompt; cached since many sessions share the same settings."""
+    context = f"\n\nContext & Business Details:\n{business_details}" if business_details else ""
+    if not persona:
+        # The default prompt already carries its own voice and email guidance
+        return f"{DEFAULT_SYSTEM_PROMPT}{context}"
+    return f"{persona}{context}{_VOICE_SUFFIX}"
+
+
 def build_system_prompt(metadata: dict) -> str:
     """Build the system prompt from participant metadata."""
-    persona = metadata.get("persona", "").strip()
-    business_details = metadata.get("businessDetails", "").strip()
+    persona = (metadata.get("persona") or "").strip()
+    business_details = (metadata.get("businessDetails") or "").strip()
     
     # If no custom settings, use default
     if not persona and not business_details:
         return DEFAULT_SYSTEM_PROMPT
     
-    # Build custom prompt from settings
-    prompt_parts = []
-    
-    if persona:
-        prompt_parts.append(persona)
-    else:
-        prompt_parts.append(DEFAULT_SYSTEM_PROMPT)
-    
-    if business_details:
-        prompt_parts.append(f"\n\nContext & Business Details:\n{business_details}")
-    
-    # Add voice-specific guidance
-    prompt_parts.append("""
+    return _assemble_system_prompt(persona, business_details)
 
-Remember: This is a voice conversation. Keep responses concise and natural.
-Avoid special characters, emojis, or formatting that doesn't translate to speech.""")
-    
-    # ALWAYS append email tool instructions - critical for custom personas
-    prompt_parts.append("""
 
-EMAIL CAPABILITY - MANDATORY:
-- When user says "send me", "email me", "message me" or wants info sent to email:
-  IMMEDIATELY call request_email_input() tool. Do NOT ask for email verbally.
-- NEVER say "what's your email?" - use the tool to show a popup instead.
-- After tool call, say ONE sentence then STOP TALKING. Wait silently.""")
-    
-    return "".join(prompt_parts)
+# Phone call (SIP) detection: "sip_"/"sip:" identity or a direct phone number,
+# or a SIP room prefix / phone number in the room name
+_SIP_IDENTITY_PREFIXES = ("sip_", "sip:", "+")
+_SIP_ROOM_PREFIX = "sip-"
+
+
+def prewarm(proc: agents.JobProcess):
+    """Load the Silero VAD model once per worker process, before any job arrives."""
+    proc.userdata["vad"] = silero.VAD.load(
+        min_speech_duration=0.1,
+        min_silence_duration=0.3,
+    )
 
 
 async def entrypoint(ctx: agents.JobContext):
     """Main entrypoint for the LiveKit voice agent."""
-    logger.info(f"Agent entrypoint started for room: {ctx.room.name}")
+    logger.info("Agent entrypoint started for room: %s", ctx.room.name)
     
     # Connect to the room
     await ctx.connect()
     logger.info("Connected to room")
     
+    # Notion saves run in the background; drain pending ones before the job exits
+    start_notion_worker()
+    ctx.add_shutdown_callback(notion_queue.join)
+    # Same for emails still on their way to Resend
+    ctx.add_shutdown_callback(email_sender.aclose)
+    
     # Wait for a participant to join
     participant = await ctx.wait_for_participant()
-    logger.info(f"Participant joined: {participant.identity}")
+    logger.info("Participant joined: %s", participant.identity)
     
     # Detect if this is a phone call (SIP participant)
     # LiveKit SIP participants have identity like "sip_+1234567890" (with underscore)
+    room_name = ctx.room.name
     is_phone_call = (
-        participant.identity.startswith("sip_") or  # SIP participant identity
-        participant.identity.startswith("sip:") or  # Alternative SIP format
-        participant.identity.startswith("+") or     # Direct phone number
-        ctx.room.name.startswith("sip-") or         # SIP room prefix
-        "_+" in ctx.room.name                       # Room contains phone number pattern
+        participant.identity.startswith(_SIP_IDENTITY_PREFIXES)
+        or room_name.startswith(_SIP_ROOM_PREFIX)
+        or "_+" in room_name
     )
-    logger.info(f"Is phone call: {is_phone_call} (participant: {participant.identity})")
+    logger.info("Is phone call: %s (participant: %s)", is_phone_call, participant.identity)
     
     # Parse participant metadata for settings (web clients send metadata, phone callers don't)
-    metadata = parse_participant_metadata(participant.metadata)
-    user_name = metadata.get("userName", "")
-    language = metadata.get("language", "en")  # Default to English
-    
-    # Track session start time for duration calculation
-    session_start_time = datetime.now()
-    
-    # Initialize conversation tracker for Notion logging
-    # For SIP calls, use phone number as the user name
-    notion_user_name = user_name if user_name else participant.identity
-    conversation_tracker = ConversationTracker(user_name=notion_user_name, is_phone_call=is_phone_call)
+    # Phone callers carry no metadata at all; skip the decode for them
+    raw_metadata = participant.metadata
+    metadata = parse_participant_metadata(raw_metadata) if raw_metadata else {}
+    user_name = metadata.get("userName") or ""
     
     # Log session start with visual banner (easy to spot in Railway logs)
     log_session_start(
@@ -1083,72 +1536,111 @@ async def entrypoint(ctx: agents.JobContext):
         is_phone=is_phone_call
     )
     
-    # Use custom phone instructions for phone calls, otherwise use web settings
-    if is_phone_call:
-        system_prompt = PHONE_AGENT_INSTRUCTIONS
-        logger.info(f"Using PHONE instructions: {system_prompt[:100]}...")
-    else:
-        system_prompt = build_system_prompt(metadata)
-    
-    logger.info(f"System prompt length: {len(system_prompt)} chars")
-    
-    # ============================================================
-    # 🎤 STT SELECTION - Based on SIP/WebRTC
-    # ============================================================
-    # For SIP calls: Use Sarvam STT for better Indian accent recognition
-    # For WebRTC: Use Deepgram Nova-3 for lower latency
-    
-    if is_phone_call:
-        # SIP calls: Sarvam STT optimized for Indian languages
-        selected_stt = sarvam.STT(
-            model="saarika:v2.5",
-            language="en-IN",  # English-India: Roman script, understands Indian accent
-        )
-        logger.info("📞 SIP call - using Sarvam STT (saarika:v2.5) for Indian accent")
-    else:
-        # WebRTC: Deepgram for faster, lower latency transcription
-        selected_stt = deepgram.STT(
-            model="nova-3",
-            language="multi",
-        )
-        logger.info("🌐 WebRTC - using Deepgram Nova-3 STT")
-    
-    # ============================================================
-    # 🔊 TTS SELECTION - Based on SIP/language preference
-    # ============================================================
-    # For SIP calls: Always use Sarvam Hindi (Vidhya) - optimized for Indian phone calls
-    # For WebRTC: Use user's language selection from frontend
-    
-    # Create Sarvam TTS (Hindi) with optimized settings
-    hindi_tts = sarvam.TTS(
+    # Call type is settled here; everything after runs on a path specialized for it
+    await (_run_phone_session if is_phone_call else _run_web_session)(ctx, participant, metadata)
+
+
+def _sarvam_hindi_tts() -> sarvam.TTS:
+    """Sarvam Hindi TTS (Vidhya), tuned for phone-quality audio."""
+    return sarvam.TTS(
         target_language_code="hi-IN",
         speaker="vidya",
         speech_sample_rate=16000,
         enable_preprocessing=True,
         pace=1.1,
     )
+
+
+async def _run_phone_session(ctx: agents.JobContext, participant: rtc.RemoteParticipant, metadata: dict):
+    """Phone (SIP) call: fixed phone persona, Sarvam STT + Hindi TTS for Indian callers."""
+    system_prompt = PHONE_AGENT_INSTRUCTIONS
+    logger.info("Using PHONE instructions: %.100s...", system_prompt)
+    
+    # Sarvam STT for better Indian accent recognition over the phone
+    stt = sarvam.STT(
+        model="saarika:v2.5",
+        language="en-IN",  # English-India: Roman script, understands Indian accent
+    )
+    logger.info("📞 SIP call - using Sarvam STT (saarika:v2.5) for Indian accent")
+    
+    # Always Hindi (Sarvam) for Indian phone users
+    tts = _sarvam_hindi_tts()
+    logger.info("📞 SIP call detected - using Sarvam Hindi TTS (Vidhya)")
+    
+    # Let the agent use its persona to introduce itself
+    greeting_instruction = "Answer the phone warmly. Introduce yourself by your name as defined in your persona and ask how you can help."
+    
+    await _run_session(
+        ctx, participant, metadata,
+        is_phone_call=True,
+        system_prompt=system_prompt,
+        stt=stt,
+        tts=tts,
+        greeting_instruction=greeting_instruction,
+    )
+
+
+async def _run_web_session(ctx: agents.JobContext, participant: rtc.RemoteParticipant, metadata: dict):
+    """WebRTC call: persona and language come from the frontend's metadata."""
+    system_prompt = build_system_prompt(metadata)
+    user_name = metadata.get("userName") or ""
+    
+    # Deepgram for faster, lower latency transcription
+    stt = deepgram.STT(
+        model="nova-3",
+        language="multi",
+    )
+    logger.info("🌐 WebRTC - using Deepgram Nova-3 STT")
     
-    # Create Deepgram TTS (English)
-    english_tts = deepgram.TTS(model="aura-2-iris-en")
+    # Use the user's language selection from the frontend (default English)
+    if metadata.get("language", "en") == "hi":
+        tts = _sarvam_hindi_tts()
+        logger.info("🇮🇳 User selected Hindi - using Sarvam TTS")
+    else:
+        tts = deepgram.TTS(model="aura-2-iris-en")
+        logger.info("🇺🇸 User selected English - using Deepgram TTS")
     
-    # Select TTS based on call type
-    if is_phone_call:
-        # SIP calls: Always use Hindi (Sarvam) for Indian phone users
-        selected_tts = hindi_tts
-        logger.info("📞 SIP call detected - using Sarvam Hindi TTS (Vidhya)")
+    if user_name:
+        greeting_instruction = f"Greet {user_name} warmly by name and offer your assistance."
     else:
-        # WebRTC: Use user's language selection
-        if language == "hi":
-            selected_tts = hindi_tts
-            logger.info("🇮🇳 User selected Hindi - using Sarvam TTS")
-        else:
-            selected_tts = english_tts
-            logger.info("🇺🇸 User selected English - using Deepgram TTS")
+        greeting_instruction = "Greet the user warmly and offer your assistance."
+    
+    await _run_session(
+        ctx, participant, metadata,
+        is_phone_call=False,
+        system_prompt=system_prompt,
+        stt=stt,
+        tts=tts,
+        greeting_instruction=greeting_instruction,
+    )
+
+
+async def _run_session(
+    ctx: agents.JobContext,
+    participant: rtc.RemoteParticipant,
+    metadata: dict,
+    *,
+    is_phone_call: bool,
+    system_prompt: str,
+    stt: agents.stt.STT,
+    tts: agents.tts.TTS,
+    greeting_instruction: str,
+):
+    """Run the agent session and wire up the handlers shared by both call types."""
+    user_name = metadata.get("userName") or ""
+    
+    # Initialize conversation tracker for Notion logging; it also times the
+    # session (monotonic clock) for the end banner
+    # For SIP calls, use phone number as the user name
+    notion_user_name = user_name if user_name else participant.identity
+    conversation_tracker = ConversationTracker(user_name=notion_user_name, is_phone_call=is_phone_call)
+    
+    logger.info("System prompt length: %d chars", len(system_prompt))
     
     # Create the agent session with all plugins
     session = AgentSession(
         # Speech-to-Text: Selected based on SIP/WebRTC
-        stt=selected_stt,
+        stt=stt,
         
         # LLM: Groq for fast inference
         llm=groq.LLM(
@@ -1157,21 +1649,17 @@ async def entrypoint(ctx: agents.JobContext):
         ),
         
         # Text-to-Speech: Selected based on SIP/language preference
-        tts=selected_tts,
+        tts=tts,
         
-        # Voice Activity Detection: Silero
-        vad=silero.VAD.load(
-            min_speech_duration=0.1,
-            min_silence_duration=0.3,
-
-        ),
+        # Voice Activity Detection: Silero (loaded once per process in prewarm)
+        vad=ctx.proc.userdata["vad"],
     )
 
     
     # Start the session with noise cancellation
     await session.start(
         room=ctx.room,
-        agent=VocalizeAgent(
+        agent=_agent_class(is_phone_call)(
             instructions=system_prompt,
             user_name=user_name,
             is_phone_call=is_phone_call,
@@ -1188,16 +1676,6 @@ async def entrypoint(ctx: agents.JobContext):
     
     logger.info("Agent session started")
     
-    # Generate initial greeting based on call type
-    if is_phone_call:
-        # Phone-specific greeting - let the agent use their persona to introduce themselves
-        greeting_instruction = "Answer the phone warmly. Introduce yourself by your name as defined in your persona and ask how you can help."
-        logger.info("Sending phone greeting")
-    elif user_name:
-        greeting_instruction = f"Greet {user_name} warmly by name and offer your assistance."
-    else:
-        greeting_instruction = "Greet the user warmly and offer your assistance."
-    
     await session.generate_reply(instructions=greeting_instruction)
     logger.info("Initial greeting sent")
     
@@ -1209,66 +1687,69 @@ async def entrypoint(ctx: agents.JobContext):
     
     async def handle_email_response(email: str):
         """Async handler to process email and generate reply."""
-        logger.info(f"📧 Processing received email: {email}")
+        logger.info("📧 Processing received email: %s", email)
         received_email["value"] = email
-        await session.generate_reply(
-            instructions=f"IMPORTANT: The user has typed their email address in the popup box. Their email is: {email}. " +
-            f"Tell them you received their email ({email}) and now ask them for the email subject line. " +
-            "Make sure to confirm the email address you received."
-        )
+        await session.generate_reply(instructions=_EMAIL_RECEIVED_INSTRUCTIONS.format(email=email))
+    
+    # Popup submissions are handled one at a time so a quick resubmit can't
+    # start a second generate_reply that talks over the first
+    email_queue: asyncio.Queue[str] = asyncio.Queue(maxsize=4)
+    
+    async def email_consumer():
+        while True:
+            email = await email_queue.get()
+            try:
+                await handle_email_response(email)
+            except Exception as e:
+                logger.error(f"Error handling email response: {e}")
+            finally:
+                email_queue.task_done()
+    
+    email_consumer_task = asyncio.create_task(email_consumer())
+    
+    async def stop_email_consumer():
+        email_consumer_task.cancel()
+    
+    ctx.add_shutdown_callback(stop_email_consumer)
     
     @ctx.room.on("data_received")
     def on_data_received(packet: rtc.DataPacket):
         """Handle data messages from frontend (e.g., email input popup response)."""
-        logger.info(f"📨 Data received event triggered! Packet type: {type(packet).__name__}")
-        
         try:
-            # DataPacket has .data attribute which contains the bytes
-            # The actual payload is in packet.data (UserPacket) which has .data (bytes)
-            raw_data = None
-            
-            # Try to get the data from the packet
-            if hasattr(packet, 'data') and hasattr(packet.data, 'data'):
-                # packet.data is UserPacket, packet.data.data is the bytes
-                raw_data = packet.data.data
-                logger.info(f"📨 Found data in packet.data.data, length: {len(raw_data)}")
-            elif hasattr(packet, 'data') and isinstance(packet.data, bytes):
-                raw_data = packet.data
-                logger.info(f"📨 Found data in packet.data (bytes), length: {len(raw_data)}")
-            elif isinstance(packet, bytes):
-                raw_data = packet
-                logger.info(f"📨 Packet is bytes, length: {len(raw_data)}")
-            else:
-                # Log what we have to debug
-                logger.info(f"📨 Packet attrs: {dir(packet)}")
-                # Last resort - try to find data attribute
-                if hasattr(packet, 'user') and hasattr(packet.user, 'data'):
-                    raw_data = bytes(packet.user.data.data)
-                    logger.info(f"📨 Found data in packet.user.data.data, length: {len(raw_data)}")
+            # rtc.DataPacket carries the payload bytes in .data; older SDKs
+            # wrapped it in a UserPacket with its own .data
+            raw_data = getattr(packet, "data", packet)
+            if not isinstance(raw_data, (bytes, bytearray)):
+                raw_data = getattr(raw_data, "data", None)
             
             if not raw_data:
-                logger.warning("📨 Could not extract data from packet")
+                logger.warning(f"📨 Could not extract data from {type(packet).__name__}")
                 return
             
-            decoded = raw_data.decode('utf-8')
-            logger.info(f"📨 Decoded data: {decoded}")
+            # The popup response is the only message handled here; skip
+            # anything else without decoding it
+            if _EMAIL_RESPONSE_MARKER not in raw_data:
+                logger.debug("📨 Ignoring data message (%d bytes)", len(raw_data))
+                return
             
-            message = json.loads(decoded)
+            # orjson parses the UTF-8 bytes directly (no intermediate str)
+            message = orjson.loads(raw_data)
             msg_type = message.get("type")
-            
-            logger.info(f"📨 Message type: {msg_type}")
+            logger.debug("📨 Data message (%d bytes), type: %s", len(raw_data), msg_type)
             
             if msg_type == "email_response":
                 email = message.get("email", "").strip()
-                logger.info(f"📧 Email extracted: {email}")
+                logger.info("📧 Email extracted: %s", email)
                 if email:
-                    # Spawn async task from sync callback
-                    asyncio.create_task(handle_email_response(email))
+                    try:
+                        email_queue.put_nowait(email)
+                    except asyncio.QueueFull:
+                        logger.warning(f"📧 Email queue full, dropping submission: {email}")
                 else:
                     logger.warning("Received empty email from popup")
                     
-        except json.JSONDecodeError as e:
-            logger.debug(f"Received non-JSON data message: {e}")
+        except orjson.JSONDecodeError as e:
+            logger.debug("Received non-JSON data message: %s", e)
         except Exception as e:
             logger.error(f"Error handling data message: {e} (type: {type(e).__name__})")
     
@@ -1282,12 +1763,20 @@ async def entrypoint(ctx: agents.JobContext):
         """Capture all conversation items (user and agent) as they're committed."""
         try:
             item = event.item
-            if item.role == "user" and item.text_content:
-                conversation_tracker.add_user_message(item.text_content)
-                logger.debug(f"Tracked user: {item.text_content[:50]}...")
-            elif item.role == "assistant" and item.text_content:
-                conversation_tracker.add_agent_message(item.text_content)
-                logger.debug(f"Tracked agent: {item.text_content[:50]}...")
+            if item.role not in ("user", "assistant"):
+                return
+            text = item.text_content  # Re-joined from the content parts on every access
+            if not text:
+                return
+            
+            if item.role == "user":
+                conversation_tracker.add_user_message(text)
+            else:
+                conversation_tracker.add_agent_message(text)
+            
+            # Skip the slice entirely unless debug logging is on
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Tracked %s: %s...", "user" if item.role == "user" else "agent", text[:50])
         except Exception as e:
             logger.error(f"Error tracking conversation item: {e}")
     
@@ -1300,18 +1789,18 @@ async def entrypoint(ctx: agents.JobContext):
             return
         notion_saved["done"] = True
         
-        duration = (datetime.now() - session_start_time).total_seconds()
+        # Same clock as the Notion duration, so the two can't disagree
+        duration = conversation_tracker.elapsed_seconds()
         log_session_end(
             room_name=ctx.room.name,
             user_name=user_name,
             duration_seconds=duration
         )
         
-        logger.info(f"Conversation has {len(conversation_tracker.messages)} messages to save")
+        logger.info("Conversation has %d messages to save", len(conversation_tracker.messages))
         
         if conversation_tracker.messages:
-            import threading
-            threading.Thread(target=save_to_notion, args=(conversation_tracker,), daemon=True).start()
+            save_to_notion(conversation_tracker)
     
     # Handler for session close (fires for both WebRTC and SIP)
     @session.on("close")
@@ -1320,7 +1809,9 @@ async def entrypoint(ctx: agents.JobContext):
         logger.info("Session close event - saving to Notion")
         save_conversation_to_notion()
     
-    # Handler for participant disconnect (backup for WebRTC)
+    # Handler for participant disconnect: livekit-agents 1.0.x doesn't close
+    # the session when the caller leaves. The notion_saved guard keeps this
+    # from saving twice on versions that do.
     @ctx.room.on("participant_disconnected")
     def on_participant_disconnected(disconnected_participant):
         if disconnected_participant.identity == participant.identity:
@@ -1336,6 +1827,7 @@ if __name__ == "__main__":
     agents.cli.run_app(
         agents.WorkerOptions(
             entrypoint_fnc=entrypoint,
+            prewarm_fnc=prewarm,
             # NOTE: No agent_name = auto-dispatch to ALL rooms (WebRTC + SIP)
             # If you need named dispatch for SIP, use a room prefix dispatch rule instead
         )